@@ -4,17 +4,17 @@ from importlib import import_module
 __all__ = [
     "ui", "wfs", "convert", "ku",
     "fetch_gml_pages", "fetch_geojson_pages", "merge_geojson_pages",
-    "bbox_from_geojson", "view_from_bbox",
+    "bbox_from_geojson", "bbox_from_features", "view_from_bbox", "parse_parcels",
     "convert_pages_with_gdal", "geojson_pages_to_dxf",
-    "load_ku_table", "lookup_ku_code",
+    "load_ku_table", "lookup_ku_code", "build_ku_index",
 ]
 
 
 def __getattr__(name: str):
-    if name in {"fetch_gml_pages","fetch_geojson_pages","merge_geojson_pages","bbox_from_geojson","view_from_bbox"}:
+    if name in {"fetch_gml_pages","fetch_geojson_pages","merge_geojson_pages","bbox_from_geojson","bbox_from_features","view_from_bbox","parse_parcels"}:
         return getattr(import_module(".wfs", __name__), name)
     if name in {"convert_pages_with_gdal","geojson_pages_to_dxf"}:
         return getattr(import_module(".convert", __name__), name)
-    if name in {"load_ku_table","lookup_ku_code"}:
+    if name in {"load_ku_table","lookup_ku_code","build_ku_index"}:
         return getattr(import_module(".ku", __name__), name)
     raise AttributeError(name)
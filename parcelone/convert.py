@@ -5,6 +5,8 @@ import io, os, shutil, subprocess, tempfile
 
 # Pozn.: držiak na GDAL_DATA, ak ho nájdeme
 GDAL_DATA_DIR: str | None = None
+# why: GPKG (SQLite) inak commituje po malých dávkach – väčšie transakcie výrazne zrýchlia zápis
+_GPKG_GT = ["-gt", "65536"]
 
 def _find_gdal_data() -> str | None:
     candidates = [
@@ -42,13 +44,29 @@ def _run_ogr(ogr: str, args: list[str]):
     if cp.returncode != 0:
         raise RuntimeError(cp.stderr.decode("utf-8", "ignore") or "ogr2ogr failed")
 
+def _read_bytes(path: str) -> bytes:
+    # why: `open(...).read()` nechá handle otvorený až do GC – pri veľkom výstupe sa drží zbytočne dlho
+    with open(path, "rb") as f:
+        return f.read()
+
+def _zip_shapefile(shp_path: str) -> bytes:
+    """Zbalí .shp a jeho sprievodné súbory (ak existujú) do ZIP v pamäti."""
+    import zipfile
+    mem = io.BytesIO()
+    with zipfile.ZipFile(mem, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6) as z:
+        base = os.path.splitext(shp_path)[0]
+        for ext in (".shp", ".shx", ".dbf", ".prj", ".cpg"):
+            fp = base + ext
+            if os.path.exists(fp):
+                z.write(fp, os.path.basename(fp))
+    return mem.getvalue()
+
 def convert_pages_with_gdal(gml_pages: List[bytes], driver: str, out_ext: str) -> tuple[bytes, str, str]:
     """GML stránky → cieľový formát cez GDAL/OGR. Vráti (data, mime, mode)."""
     if not gml_pages:
         raise RuntimeError("Žiadne GML stránky na konverziu.")
     mode, handle = ensure_gdal()
 
-    import zipfile
     with tempfile.TemporaryDirectory() as td:
         # zapíš GML stránky
         gml_paths: list[str] = []
@@ -66,13 +84,13 @@ def convert_pages_with_gdal(gml_pages: List[bytes], driver: str, out_ext: str) -
                 from osgeo import gdal  # type: ignore
                 gdal.UseExceptions()
                 opts = gdal.VectorTranslateOptions(
-                    format="GPKG", layerName=layer,
+                    options=list(_GPKG_GT), format="GPKG", layerName=layer,
                     geometryType="MULTIPOLYGON", explodeCollections=True
                 )
                 gdal.VectorTranslate(gpkg_path, gml_paths[0], options=opts)
                 for p in gml_paths[1:]:
                     opts_app = gdal.VectorTranslateOptions(
-                        format="GPKG", layerName=layer, accessMode="append",
+                        options=list(_GPKG_GT), format="GPKG", layerName=layer, accessMode="append",
                         geometryType="MULTIPOLYGON", explodeCollections=True
                     )
                     try:
@@ -83,62 +101,49 @@ def convert_pages_with_gdal(gml_pages: List[bytes], driver: str, out_ext: str) -
                     out_path = os.path.join(td, "parcely.dxf")
                     opts_dxf = gdal.VectorTranslateOptions(format="DXF", layerName=layer)
                     gdal.VectorTranslate(out_path, gpkg_path, options=opts_dxf)
-                    return open(out_path, "rb").read(), "application/dxf", mode
+                    return _read_bytes(out_path), "application/dxf", mode
                 else:
                     shp_path = os.path.join(td, "parcely.shp")
                     opts_shp = gdal.VectorTranslateOptions(format="ESRI Shapefile", layerName=layer)
                     gdal.VectorTranslate(shp_path, gpkg_path, options=opts_shp)
-                    mem = io.BytesIO()
-                    with zipfile.ZipFile(mem, "w") as z:
-                        base = os.path.splitext(shp_path)[0]
-                        for ext in (".shp", ".shx", ".dbf", ".prj", ".cpg"):
-                            fp = base + ext
-                            if os.path.exists(fp):
-                                z.write(fp, os.path.basename(fp))
-                    return mem.getvalue(), "application/zip", mode
+                    return _zip_shapefile(shp_path), "application/zip", mode
             else:
                 ogr = handle  # type: ignore[assignment]
-                _run_ogr(ogr, ["-f","GPKG", gpkg_path, gml_paths[0], "-nln", layer, "-nlt","MULTIPOLYGON", "-explodecollections"])
+                _run_ogr(ogr, ["-f","GPKG", gpkg_path, gml_paths[0], "-nln", layer, "-nlt","MULTIPOLYGON", "-explodecollections", *_GPKG_GT])
                 for p in gml_paths[1:]:
                     try:
-                        _run_ogr(ogr, ["-f","GPKG", gpkg_path, p, "-nln", layer, "-update","-append", "-nlt","MULTIPOLYGON", "-explodecollections"])
+                        _run_ogr(ogr, ["-f","GPKG", gpkg_path, p, "-nln", layer, "-update","-append", "-nlt","MULTIPOLYGON", "-explodecollections", *_GPKG_GT])
                     except Exception:
                         pass
                 if driver == "DXF":
                     out_path = os.path.join(td, "parcely.dxf")
                     _run_ogr(ogr, ["-f","DXF", out_path, gpkg_path, "-nln", layer])
-                    return open(out_path, "rb").read(), "application/dxf", mode
+                    return _read_bytes(out_path), "application/dxf", mode
                 else:
                     shp_path = os.path.join(td, "parcely.shp")
                     _run_ogr(ogr, ["-f","ESRI Shapefile", shp_path, gpkg_path, "-nln", layer])
-                    mem = io.BytesIO()
-                    with zipfile.ZipFile(mem, "w") as z:
-                        base = os.path.splitext(shp_path)[0]
-                        for ext in (".shp", ".shx", ".dbf", ".prj", ".cpg"):
-                            fp = base + ext
-                            if os.path.exists(fp):
-                                z.write(fp, os.path.basename(fp))
-                    return mem.getvalue(), "application/zip", mode
+                    return _zip_shapefile(shp_path), "application/zip", mode
 
         # ostatné formáty priamo
         out_path = os.path.join(td, f"out{out_ext}")
+        gt = _GPKG_GT if driver == "GPKG" else []
         if mode == "python-gdal":
             from osgeo import gdal  # type: ignore
             gdal.UseExceptions()
-            opts = gdal.VectorTranslateOptions(format=driver, layerName="parcely")
+            opts = gdal.VectorTranslateOptions(options=list(gt), format=driver, layerName="parcely")
             gdal.VectorTranslate(out_path, gml_paths[0], options=opts)
             for p in gml_paths[1:]:
-                opts_app = gdal.VectorTranslateOptions(format=driver, layerName="parcely", accessMode="append")
+                opts_app = gdal.VectorTranslateOptions(options=list(gt), format=driver, layerName="parcely", accessMode="append")
                 try:
                     gdal.VectorTranslate(out_path, p, options=opts_app)
                 except Exception:
                     pass
         else:
             ogr = handle  # type: ignore[assignment]
-            _run_ogr(ogr, ["-f", driver, out_path, gml_paths[0], "-nln", "parcely"])
+            _run_ogr(ogr, ["-f", driver, out_path, gml_paths[0], "-nln", "parcely", *gt])
             for p in gml_paths[1:]:
                 try:
-                    _run_ogr(ogr, ["-f", driver, out_path, p, "-nln", "parcely", "-update", "-append"])
+                    _run_ogr(ogr, ["-f", driver, out_path, p, "-nln", "parcely", "-update", "-append", *gt])
                 except Exception:
                     pass
 
@@ -146,44 +151,56 @@ def convert_pages_with_gdal(gml_pages: List[bytes], driver: str, out_ext: str) -
             ".geojson": "application/geo+json",
             ".gpkg": "application/geopackage+sqlite3",
         }.get(out_ext, "application/octet-stream")
-        return open(out_path, "rb").read(), mime, mode
+        return _read_bytes(out_path), mime, mode
+
+# Pozn.: HEADER + TABLES (vrstva PARCELY) sú pre každý export rovnaké – skladáme ich raz pri importe
+_DXF_LAYER = "PARCELY"
+_DXF_HEAD: bytes = ("\r\n".join((
+    "0", "SECTION", "2", "HEADER", "9", "$ACADVER", "1", "AC1024",
+    "0", "ENDSEC",
+    "0", "SECTION", "2", "TABLES",
+    "0", "TABLE", "2", "LAYER", "70", "1",
+    "0", "LAYER", "2", _DXF_LAYER, "70", "0", "62", "7", "6", "CONTINUOUS",
+    "0", "ENDTAB", "0", "ENDSEC",
+    "0", "SECTION", "2", "ENTITIES",
+)) + "\r\n").encode("utf-8")
+_DXF_TAIL = b"0\r\nENDSEC\r\n0\r\nEOF\r\n"
 
 def geojson_pages_to_dxf(json_pages: List[bytes]) -> Tuple[bytes, str]:
     """GeoJSON → ASCII DXF (R2000) s LWPOLYLINE. Čistý Python, bez GDAL/ezdxf."""
-    import json
-    def fmt(v: float) -> str: return ("%.8f" % float(v)).rstrip("0").rstrip(".")
-    def add(code, val, out): out.append(str(code)); out.append(str(val))
+    from .wfs import iter_geojson_features
+    def fmt(v: float) -> str: return ("%.8f" % v).rstrip("0").rstrip(".")
     def to_polylines(obj):
         rings = []
         def add_ring(ring):
-            pts = [(float(x), float(y)) for x, y in ring if isinstance(x,(int,float)) and isinstance(y,(int,float))]
+            # why: bežne sú to čisté číselné páry – `+ 0.0` je lacnejšie než float() + isinstance na každý vrchol;
+            # kontrolu typov robíme len pre chybný kruh
+            try: pts = [(x + 0.0, y + 0.0) for x, y, *_ in ring]
+            except (TypeError, ValueError):
+                pts = [(float(c[0]), float(c[1])) for c in ring
+                       if isinstance(c, (list, tuple)) and len(c) >= 2
+                       and isinstance(c[0], (int, float)) and isinstance(c[1], (int, float))]
             if len(pts) < 2: return
             if pts[0] == pts[-1]: pts.pop()
             if len(pts) >= 2: rings.append(pts)
-        g = (obj or {}).get("geometry") or {}; t = g.get("type")
+        # why: WFS vracia korektné dicty – priamy prístup, chybné features len preskočíme
+        try: g = obj["geometry"]; t = g["type"]; coords = g["coordinates"] or ()
+        except (KeyError, TypeError): return rings
         if t == "Polygon":
-            for ring in g.get("coordinates", []): add_ring(ring)
+            for ring in coords: add_ring(ring)
         elif t == "MultiPolygon":
-            for poly in g.get("coordinates", []):
+            for poly in coords:
                 for ring in poly: add_ring(ring)
         return rings
-    polylines = []
-    for jb in json_pages:
-        try: obj = json.loads(jb.decode("utf-8", "ignore"))
-        except Exception: obj = {}
-        for f in obj.get("features", []): polylines.extend(to_polylines(f))
-    LAYER = "PARCELY"; out: list[str] = []
-    add(0, "SECTION", out); add(2, "HEADER", out); add(9, "$ACADVER", out); add(1, "AC1024", out)
-    add(0, "ENDSEC", out)
-    add(0, "SECTION", out); add(2, "TABLES", out)
-    add(0, "TABLE", out); add(2, "LAYER", out); add(70, 1, out)
-    add(0, "LAYER", out); add(2, LAYER, out); add(70, 0, out); add(62, 7, out); add(6, "CONTINUOUS", out)
-    add(0, "ENDTAB", out); add(0, "ENDSEC", out)
-    add(0, "SECTION", out); add(2, "ENTITIES", out)
+    # why: features idú priamo zo stránok a každá entita sa hneď zakóduje do buffera –
+    # nedržíme zoznam všetkých polylínií ani celý dokument ako zoznam str
+    polylines = (pts for f in iter_geojson_features(json_pages) for pts in to_polylines(f))
+    ent_head = ("0", "LWPOLYLINE", "100", "AcDbEntity", "8", _DXF_LAYER, "100", "AcDbPolyline", "90")
+    buf = io.BytesIO(); buf.write(_DXF_HEAD)
     for pts in polylines:
         if len(pts) < 2: continue
-        add(0, "LWPOLYLINE", out); add(100, "AcDbEntity", out); add(8, LAYER, out)
-        add(100, "AcDbPolyline", out); add(90, len(pts), out); add(70, 1, out)
-        for x, y in pts: add(10, fmt(x), out); add(20, fmt(y), out)
-    add(0, "ENDSEC", out); add(0, "EOF", out)
-    return ("\r\n".join(out) + "\r\n").encode("utf-8"), "application/dxf"
+        ent = list(ent_head); ent.extend((str(len(pts)), "70", "1"))
+        for x, y in pts: ent.extend(("10", fmt(x), "20", fmt(y)))
+        buf.write(("\r\n".join(ent) + "\r\n").encode("utf-8"))
+    buf.write(_DXF_TAIL)
+    return buf.getvalue(), "application/dxf"
@@ -1,40 +1,39 @@
 from __future__ import annotations
 from typing import Tuple
 import importlib.resources as res
+from functools import lru_cache
+from itertools import islice
 import io, re, unicodedata
 
 _KU_QUOTED_RE = re.compile(r'^\s*"(?P<name>.+?)"\s+(?P<code>\d{6,})\s*$')
+# why: pomlčky (-–—) tiež nie sú [a-z0-9 ] – samostatný prechod pre ne je zbytočný
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9 ]+")
+# why: názvy sú po NFD takmer vždy ASCII – translate je jeden prechod v C; regex ostáva len pre zvyšok
+_ASCII_TO_SPACE = {i: " " for i in range(128) if chr(i) not in "abcdefghijklmnopqrstuvwxyz0123456789 "}
 
 def _strip_accents(s: str) -> str:
     if not s: return ""
     s = unicodedata.normalize("NFD", s)
-    s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
+    if not s.isascii(): s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
     s = s.lower()
-    s = re.sub(r"[\-–—]+", " ", s)
-    s = re.sub(r"[^a-z0-9 ]+", " ", s)
+    s = s.translate(_ASCII_TO_SPACE)
+    if not s.isascii(): s = _NON_ALNUM_RE.sub(" ", s)
     return " ".join(s.split())
 
+# why: tie isté dopyty sa pri písaní/rerunoch opakujú; tabuľku normalizujeme priamo, aby cache nevytláčala
+_norm_query = lru_cache(maxsize=1024)(_strip_accents)
+
 def _parse_ku_line(line: str):
     m = _KU_QUOTED_RE.match((line or "").strip())
     if not m: return None, None
     return m.group("code"), m.group("name").strip()
 
-def load_ku_table(file_bytes: bytes | None = None) -> list[dict]:
-    """Load KU codes from `parcelone/data/KodKU.txt` or provided bytes."""
-    text = ""
-    if file_bytes is not None:
-        try: text = file_bytes.decode("utf-8", "ignore")
-        except Exception: text = file_bytes.decode("cp1250", "ignore")
-    else:
-        try:
-            with res.files("parcelone.data").joinpath("KodKU.txt").open("rb") as f:
-                raw = f.read()
-            try: text = raw.decode("utf-8", "ignore")
-            except Exception: text = raw.decode("cp1250", "ignore")
-        except Exception:
-            return []  # why: app funguje aj bez tabuľky (užívateľ môže zadať kód KU ručne)
+def _ku_items(lines) -> list[dict]:
     items, seen = [], set()
-    for line in text.splitlines():
+    for raw in lines:
+        # why: dekódujeme po riadkoch – celý súbor ako str + splitlines() netreba; cp1250 len pre chybný riadok
+        try: line = raw.decode("utf-8")
+        except UnicodeDecodeError: line = raw.decode("cp1250", "ignore")
         code, name = _parse_ku_line(line)
         if not code or code in seen: continue
         seen.add(code)
@@ -42,13 +41,36 @@ def load_ku_table(file_bytes: bytes | None = None) -> list[dict]:
         items.append({"code": code, "name": nm, "norm": _strip_accents(nm)})
     return items
 
-def lookup_ku_code(ku_table: list[dict], query: str) -> tuple[str | None, list[dict]]:
+def load_ku_table(file_bytes: bytes | None = None) -> list[dict]:
+    """Load KU codes from `parcelone/data/KodKU.txt` or provided bytes."""
+    if file_bytes is not None:
+        return _ku_items(io.BytesIO(file_bytes))
+    try:
+        with res.files("parcelone.data").joinpath("KodKU.txt").open("rb") as f:
+            return _ku_items(f)
+    except Exception:
+        return []  # why: app funguje aj bez tabuľky (užívateľ môže zadať kód KU ručne)
+
+KuIndex = Tuple[dict, list, tuple]  # (norm → položka, položky zoradené podľa (dĺžka, norm), ich norm-y)
+
+def build_ku_index(ku_table: list[dict]) -> KuIndex:
+    """Index pre lookup: presná zhoda cez dict (vyhráva prvý výskyt) a tabuľka v poradí návrhov."""
+    by_norm: dict[str, dict] = {}
+    for it in ku_table: by_norm.setdefault(it["norm"], it)
+    # why: návrhy sa radia podľa (dĺžka, norm) – keď je tabuľka zoradená vopred (stabilne), stačí
+    # zobrať prvých 10 zhôd a skončiť, bez prechodu celej tabuľky a triedenia
+    ordered = sorted(ku_table, key=lambda x: (len(x["norm"]), x["norm"]))
+    # why: paralelná n-tica norm-ov – fulltext prechádza len reťazce, bez dict lookupu na každú položku
+    return by_norm, ordered, tuple(it["norm"] for it in ordered)
+
+def lookup_ku_code(ku_table: list[dict], query: str, index: KuIndex | None = None) -> tuple[str | None, list[dict]]:
     q = (query or "").strip()
     if not q: return None, []
     if q.isdigit(): return q, []
-    nq = _strip_accents(q)
-    for it in ku_table:
-        if it["norm"] == nq: return it["code"], [it]
-    hits = [it for it in ku_table if nq in it["norm"] or it["norm"].startswith(nq)]
-    hits.sort(key=lambda x: (len(x["norm"]), x["norm"]))
-    return (hits[0]["code"], hits[:10]) if hits else (None, [])
+    nq = _norm_query(q)
+    by_norm, ordered, norms = index if index is not None else build_ku_index(ku_table)
+    it = by_norm.get(nq)
+    if it is not None: return it["code"], [it]
+    # startswith je podmnožina `in`
+    hits = [ordered[i] for i in islice((i for i, n in enumerate(norms) if nq in n), 10)]
+    return (hits[0]["code"], hits) if hits else (None, [])
@@ -1,22 +1,26 @@
 # path: parcelone/ui.py
 from __future__ import annotations
 from typing import Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
 import io, zipfile
 
 import streamlit as st
+import streamlit.components.v1 as components
 import folium
-from streamlit_folium import st_folium
 
 # Debug utils (bezpečné – používame len ak existujú)
 from parcelone import wfs as _wfs  # get_last_http(), wfs_capabilities()
+# why: modul sa počas behu nemení – dostupnosť debug funkcií zistíme raz pri importe, nie pri každom rerune
+_WFS_CAPS_FN = getattr(_wfs, "wfs_capabilities", None)
+_WFS_LAST_HTTP_FN = getattr(_wfs, "get_last_http", None)
 
 from .wfs import (
     fetch_gml_pages, fetch_geojson_pages, merge_geojson_pages,
-    bbox_from_geojson, WMS_URL_C, WMS_URL_E, LAYER_C, LAYER_E, ZONE_C, ZONE_E,
-    fetch_zone_bbox,
+    bbox_from_features, WMS_URL_C, WMS_URL_E, LAYER_C, LAYER_E, ZONE_C, ZONE_E,
+    fetch_zone_bbox, FetchResult, parse_parcels,
 )
-from .convert import convert_pages_with_gdal
-from .ku import load_ku_table, lookup_ku_code
+from .convert import convert_pages_with_gdal, ensure_gdal
+from .ku import load_ku_table, lookup_ku_code, build_ku_index, KuIndex
 
 # --- Konštanty / voľby ---
 WFS_CRS_CHOICES = {
@@ -25,24 +29,129 @@ WFS_CRS_CHOICES = {
     "EPSG:4258 (ETRS89)": "EPSG:4258",
     "EPSG:4326 (WGS84)": "EPSG:4326",
 }
+_CRS_LABELS = tuple(WFS_CRS_CHOICES)  # why: voľby sú konštantné – zoznam pre selectbox nestaviame pri každom rerune
+# fmt → (GDAL driver, prípona pre GDAL, text tlačidla, prípona stiahnutého súboru)
+EXPORT_FORMATS = {
+    "geojson": ("GeoJSON", ".geojson", "Stiahnuť GeoJSON", ".geojson"),
+    "shp": ("ESRI Shapefile", ".shp", "Stiahnuť SHP (ZIP)", ".zip"),
+    "dxf": ("DXF", ".dxf", "Stiahnuť DXF", ".dxf"),
+    "gpkg": ("GPKG", ".gpkg", "Stiahnuť GPKG", ".gpkg"),
+}
+PREVIEW_MAX_FEATURES = 4000  # náhľad mapy – viac prvkov sa nesťahuje ani nekreslí
+PREVIEW_PROPERTIES = ("label", "geometry")  # náhľad kreslí len geometriu – ostatné atribúty INSPIRE CP netreba ťahať
+
+# --- Cache WFS volaní (rerun pri každom widgete nesmie znova ťahať tie isté stránky) ---
+
+class _Uncached(Exception):
+    """Nesie výsledok, ktorý st.cache_data nemá uložiť (výnimky sa necacheujú)."""
+    def __init__(self, result):
+        super().__init__(); self.result = result
+
+@st.cache_data(ttl=3600, max_entries=8, show_spinner=False)
+def _cached_fetch(reg: str, ku: str, parcels: str, wfs_srs: Optional[str]) -> FetchResult:
+    res = fetch_gml_pages(reg, ku, parcels, wfs_srs=wfs_srs)
+    if not res.ok:
+        raise _Uncached(res)  # why: chyby sa necacheujú, ďalší rerun to skúsi znova
+    return res
+
+def _fetch_pages(reg: str, ku: str, parcels: str, wfs_srs: Optional[str]) -> FetchResult:
+    try:
+        return _cached_fetch(reg, ku, parcels, wfs_srs)
+    except _Uncached as e:
+        return e.result
+
+@st.cache_data(ttl=3600, max_entries=8, show_spinner=False)
+def _gml_zip(reg: str, ku: str, parcels: str, wfs_srs: Optional[str], _pages: list[bytes]) -> bytes:
+    # why: ZIP staviame len keď je GML vybrané; kľúčom je dopyt (rovnaký ako pri _cached_fetch),
+    # `_pages` Streamlit nehashuje – inak by pri každom rerune hashoval megabajty GML
+    mem_zip = io.BytesIO()
+    # why: GML je veľmi redundantné XML – deflate ho zmenší ~8–10× už na úrovni 1, vyššie úrovne stoja
+    # násobne viac CPU za pár percent
+    with zipfile.ZipFile(mem_zip, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for i, b in enumerate(_pages, 1):
+            zf.writestr(f"parcely_{i:03d}.gml", b)
+    return mem_zip.getvalue()
+
+@st.cache_data(ttl=3600, max_entries=16, show_spinner=False)
+def _convert(reg: str, ku: str, parcels: str, wfs_srs: Optional[str], fmt: str,
+             _job: Optional[Future] = None) -> tuple[bytes, str, str]:
+    # why: prepínanie formátov/rerun nesmie znova púšťať GDAL nad tými istými stránkami; kľúč ako pri _gml_zip.
+    # Volá sa len z vlákna skriptu: bez `_job` je to len dotaz na cache (miss sa necacheuje), s `_job`
+    # uloží výsledok GDAL konverzie, ktorá beží vo workeri
+    if _job is None:
+        raise _Uncached(None)
+    return _job.result()
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _cached_zone_bbox(reg: str, ku: str) -> Tuple[float, float, float, float]:
+    bb = fetch_zone_bbox(reg, ku)
+    if bb is None:
+        raise _Uncached(None)  # why: None môže byť aj výpadok WFS
+    return bb
+
+def _zone_bbox(reg: str, ku: str) -> Optional[Tuple[float, float, float, float]]:
+    try:
+        return _cached_zone_bbox(reg, ku)
+    except _Uncached:
+        return None
+
+@st.cache_data(ttl=3600, max_entries=8, show_spinner=False)
+def _cached_preview(reg: str, ku: str, parcels: str) -> tuple[dict, int, int, Optional[Tuple[float, float, float, float]]]:
+    # why: cacheujeme už zlúčenú kolekciu + bbox – surové GeoJSON stránky v pamäti nedržíme
+    # a rerun nemusí znova parsovať a prechádzať súradnice
+    # stránky nad limit náhľadu sa nesťahujú; celkový počet doplní numberMatched
+    gj = fetch_geojson_pages(reg, ku, parcels, wfs_srs="EPSG:4326", max_features=PREVIEW_MAX_FEATURES,
+                             properties=PREVIEW_PROPERTIES)
+    if not (gj.ok and gj.pages):
+        raise _Uncached(None)
+    fc, total, used = merge_geojson_pages(gj.pages, max_features=PREVIEW_MAX_FEATURES)
+    return fc, max(total, gj.matched or 0), used, bbox_from_features(fc["features"])
+
+def _preview(reg: str, ku: str, parcels: str):
+    """Vráti (fc, total, used, bbox) pre náhľad alebo None, ak WFS nevrátil dáta."""
+    try:
+        return _cached_preview(reg, ku, parcels)
+    except _Uncached:
+        return None
+
+# why: KodKU.txt sa počas behu nemení – parsujeme ho raz za proces; cache_resource (nie cache_data),
+# lebo tabuľku len čítame a nechceme ju pri každom zásahu deserializovať
+@st.cache_resource(show_spinner=False)
+def _ku_table() -> list[dict]:
+    return load_ku_table()
+
+@st.cache_resource(show_spinner=False)
+def _ku_index() -> KuIndex:
+    return build_ku_index(_ku_table())
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def _cached_ku_lookup(query: str) -> tuple[Optional[str], list[dict]]:
+    return lookup_ku_code(_ku_table(), query, _ku_index())
 
 # --- Helpery pre náhľad ---
+_CQL_QUOTE = str.maketrans({"'": "''"})
+
 def _build_cql_for_preview(ku: str, parcels_csv: str) -> str:
     parts = []
     ku = (ku or "").strip()
     if ku:
         parts.append(f"nationalCadastralReference LIKE '{ku}%'")
-    pcs = [p.strip() for p in (parcels_csv or '').replace(';', ',').split(',') if p.strip()]
+    pcs = parse_parcels(parcels_csv or "")
     if pcs and ku:
-        ors = " OR ".join(["label='" + p.replace("'", "''") + "'" for p in pcs])
-        parts.append(f"({ors})")
+        # why: jeden IN namiesto reťaze OR – kratšia URL dlaždice a GeoServer ho vyhodnotí ako množinu
+        parts.append("label IN ('" + "','".join(p.translate(_CQL_QUOTE) for p in pcs) + "')")
     return " AND ".join(parts)
 
 def _cql_for_zone(ku: str) -> str:
     ku = (ku or "").strip()
     return f"nationalCadastralReference='{ku}'" if ku else ""
 
-def show_map_preview(reg: str, fc_geojson: Optional[dict], bbox: Optional[Tuple[float,float,float,float]], *, ku: str = "", parcels: str = ""):
+@st.cache_data(ttl=3600, max_entries=8, show_spinner=False)
+def _map_html(reg: str, bbox: Optional[Tuple[float,float,float,float]], ku: str, parcels: str,
+              n_feats: Optional[int], _fc: Optional[dict]) -> str:
+    # why: pre rovnaký vstup je mapa bajtovo rovnaká – folium skladáme a renderujeme raz; `_fc` (tisíce features)
+    # nehashujeme – kľúčom sú dáta z neho odvodené (počet prvkov + `bbox`, ktorý je pri náhľade bbox z `_fc`), takže
+    # nové dáta z WFS po vypadnutí _cached_preview nenájdu starú mapu; ttl/max_entries nie sú väčšie než pri _cached_preview
     default_center = (48.7, 19.7); default_zoom = 8
     if bbox:
         minx, miny, maxx, maxy = bbox
@@ -51,7 +160,8 @@ def show_map_preview(reg: str, fc_geojson: Optional[dict], bbox: Optional[Tuple[
     else:
         center = default_center; zoom = default_zoom
 
-    m = folium.Map(location=list(center), zoom_start=zoom, tiles=None, control_scale=True)
+    # why: náhľad môže mať tisíce polygónov – canvas renderer nekreslí každý ako samostatný SVG uzol v DOM
+    m = folium.Map(location=list(center), zoom_start=zoom, tiles=None, control_scale=True, prefer_canvas=True)
     folium.TileLayer("OpenStreetMap", control=False).add_to(m)
 
     is_E = (reg or '').upper() == 'E'
@@ -60,23 +170,30 @@ def show_map_preview(reg: str, fc_geojson: Optional[dict], bbox: Optional[Tuple[
     zone  = ZONE_E     if is_E else ZONE_C
 
     cql_parc = _build_cql_for_preview(ku, parcels or "")
-    p = dict(layers=layer, fmt="image/png", transparent=True, overlay=True, control=False, version="1.3.0",
-             attr="© GKÚ SR / INSPIRE")
+    cql_zone = _cql_for_zone(ku)
+    # why: dlaždice sa dopytujú až po dokončení posunu/zoomu, nie priebežne – menej WMS requestov na GeoServer.
+    # Hranica KU ostáva samostatná vrstva: má vlastnú opacity=0.8, čo jeden `layers=a,b` request nevyjadrí
+    tile_opts = dict(fmt="image/png", transparent=True, overlay=True, control=False, version="1.3.0",
+                     attr="© GKÚ SR / INSPIRE", updateWhenIdle=True, updateWhenZooming=False)
+    p = dict(layers=layer, **tile_opts)
     if cql_parc:
         p["CQL_FILTER"] = cql_parc
     folium.raster_layers.WmsTileLayer(url=url, name="Parcely (WMS)", **p).add_to(m)
 
-    cql_zone = _cql_for_zone(ku)
-    zp = dict(layers=zone, fmt="image/png", transparent=True, overlay=True, control=False, version="1.3.0",
-              attr="© GKÚ SR / INSPIRE", opacity=0.8)
+    zp = dict(layers=zone, opacity=0.8, **tile_opts)
     if cql_zone:
         zp["CQL_FILTER"] = cql_zone
     folium.raster_layers.WmsTileLayer(url=url, name="Hranica KU", **zp).add_to(m)
 
-    if (parcels or '').strip() and fc_geojson:
-        folium.GeoJson(fc_geojson, name="Vybrané parcely (WFS)", style_function=lambda _: {"weight": 3, "fill": False}).add_to(m)
+    if (parcels or '').strip() and _fc:
+        folium.GeoJson(_fc, name="Vybrané parcely (WFS)", style_function=lambda _: {"weight": 3, "fill": False}).add_to(m)
+
+    return m.get_root().render()
 
-    st_folium(m, height=540, returned_objects=[])
+def show_map_preview(reg: str, fc_geojson: Optional[dict], bbox: Optional[Tuple[float,float,float,float]], *, ku: str = "", parcels: str = ""):
+    # why: z mapy nič nečítame (predtým returned_objects=[]) – stačí statické HTML v iframe, bez st_folium
+    n_feats = len(fc_geojson.get("features") or []) if fc_geojson is not None else None
+    components.html(_map_html(reg, bbox, ku, parcels or "", n_feats, fc_geojson), height=540)
 
 # --- Hlavný vstup ---
 def main():
@@ -92,8 +209,8 @@ def main():
         with col_ku2:
             ku_name = st.text_input("...alebo názov", placeholder="napr. Bratislava-Staré Mesto")
         parcels = st.text_area("Parcelné čísla (voliteľné)", placeholder="napr. 1234/1, 1234/2")
-        fmt = st.selectbox("Výstupový formát", ["gml-zip", "geojson", "shp", "dxf", "gpkg"], index=0)
-        crs_label = st.selectbox("CRS (WFS srsName)", list(WFS_CRS_CHOICES.keys()), index=0)  # default: auto
+        fmts = st.multiselect("Výstupové formáty", ["gml-zip", *EXPORT_FORMATS], default=["gml-zip"])
+        crs_label = st.selectbox("CRS (WFS srsName)", _CRS_LABELS, index=0)  # default: auto
         wfs_srs = WFS_CRS_CHOICES[crs_label]
         debug = st.checkbox("🧪 Debug panel", value=False)
         st.caption("**Kontakt**  •  📞 +421 948 955 128  •  ✉️ svitokerik02@gmail.com")
@@ -101,11 +218,10 @@ def main():
     col1, col2 = st.columns([2, 1])
 
     # KU lookup
-    ku_table = load_ku_table()
     resolved_ku = (ku_code or "").strip()
     ku_suggestions: list[dict] = []
     if not resolved_ku:
-        resolved_ku, ku_suggestions = lookup_ku_code(ku_table, ku_name or "")
+        resolved_ku, ku_suggestions = _cached_ku_lookup(ku_name or "")
     soft_pick = ku_suggestions[0] if (not resolved_ku and ku_suggestions) else None
 
     if ku_name and not resolved_ku:
@@ -123,12 +239,12 @@ def main():
     __ku_for_preview = resolved_ku or (soft_pick['code'] if soft_pick else "")
     with col1:
         with st.spinner("Pripravujem mapový náhľad…"):
-            zone_bbox = fetch_zone_bbox(reg, __ku_for_preview) if __ku_for_preview else None
+            zone_bbox = _zone_bbox(reg, __ku_for_preview) if __ku_for_preview else None
             if (parcels or '').strip():
-                gj = fetch_geojson_pages(reg, __ku_for_preview, parcels, wfs_srs="EPSG:4326")
-                if gj.ok and gj.pages:
-                    fc, total, used = merge_geojson_pages(gj.pages, max_features=4000)
-                    bb = bbox_from_geojson(fc) or zone_bbox
+                pv = _preview(reg, __ku_for_preview, parcels)
+                if pv:
+                    fc, total, used, bb = pv
+                    bb = bb or zone_bbox
                     show_map_preview(reg, fc, bb, ku=__ku_for_preview, parcels=parcels)
                     if used < total:
                         st.caption(f"Náhľad skrátený: {used} z {total} prvkov.")
@@ -141,8 +257,7 @@ def main():
     # Debug panel (bezpečný – len ak sú utils dostupné)
     if debug:
         with st.expander("🧪 WFS diagnostika", expanded=True):
-            cap_fn = getattr(_wfs, "wfs_capabilities", None)
-            last_fn = getattr(_wfs, "get_last_http", None)
+            cap_fn, last_fn = _WFS_CAPS_FN, _WFS_LAST_HTTP_FN
             if callable(cap_fn):
                 ok_c, url_c = cap_fn(_wfs.CP_WFS_BASE)
                 ok_e, url_e = cap_fn(_wfs.CP_UO_WFS_BASE)
@@ -158,7 +273,7 @@ def main():
         return
 
     with st.spinner("Naťahujem GML stránky z WFS…"):
-        result = fetch_gml_pages(reg, resolved_ku or "", parcels, wfs_srs=wfs_srs)
+        result = _fetch_pages(reg, resolved_ku or "", parcels, wfs_srs)
 
     with col1:
         if not result.ok or not result.pages:
@@ -166,36 +281,40 @@ def main():
             return
         st.success(f"Parcely pripravené. Stránok: {len(result.pages)}")
 
-        mem_zip = io.BytesIO()
-        with zipfile.ZipFile(mem_zip, mode="w") as zf:
-            for i, b in enumerate(result.pages, 1):
-                zf.writestr(f"parcely_{i:03d}.gml", b)
-        gml_zip = mem_zip.getvalue()
-
-        if fmt == "gml-zip":
+        base_name = f"parcely_{reg}_{resolved_ku or 'filter'}"
+        if not fmts:
+            st.info("Vyber aspoň jeden výstupový formát.")
+        if "gml-zip" in fmts:
+            gml_zip = _gml_zip(reg, resolved_ku or "", parcels, wfs_srs, result.pages)
             st.download_button("Stiahnuť GML (ZIP)", data=gml_zip,
-                               file_name=f"parcely_{reg}_{resolved_ku or 'filter'}.zip", mime="application/zip")
-        else:
+                               file_name=f"{base_name}.zip", mime="application/zip", key="dl_gml-zip")
+        conv_fmts = [f for f in fmts if f in EXPORT_FORMATS]
+        ku_key = resolved_ku or ""
+        done: dict = {}
+        for f in conv_fmts:
+            try: done[f] = _convert(reg, ku_key, parcels, wfs_srs, f)
+            except _Uncached: pass
+        todo = [f for f in conv_fmts if f not in done]
+        if todo:
+            # why: ensure_gdal zapisuje GDAL_DATA do os.environ – spravíme to raz tu, na vlákne skriptu; volania
+            # vo workeroch potom už nájdu GDAL_DATA nastavené a prostredie nemenia
             try:
-                if fmt == "geojson":
-                    data, mime, conv_src = convert_pages_with_gdal(result.pages, "GeoJSON", ".geojson")
-                    st.download_button("Stiahnuť GeoJSON", data=data,
-                                       file_name=f"parcely_{reg}_{resolved_ku or 'filter'}.geojson", mime=mime)
-                    st.caption(f"Konverzia: {conv_src}")
-                elif fmt == "shp":
-                    data, mime, conv_src = convert_pages_with_gdal(result.pages, "ESRI Shapefile", ".shp")
-                    st.download_button("Stiahnuť SHP (ZIP)", data=data,
-                                       file_name=f"parcely_{reg}_{resolved_ku or 'filter'}.zip", mime=mime)
-                    st.caption(f"Konverzia: {conv_src}")
-                elif fmt == "dxf":
-                    data, mime, conv_src = convert_pages_with_gdal(result.pages, "DXF", ".dxf")
-                    st.download_button("Stiahnuť DXF", data=data,
-                                       file_name=f"parcely_{reg}_{resolved_ku or 'filter'}.dxf", mime=mime)
-                    st.caption(f"Konverzia: {conv_src}")
-                elif fmt == "gpkg":
-                    data, mime, conv_src = convert_pages_with_gdal(result.pages, "GPKG", ".gpkg")
-                    st.download_button("Stiahnuť GPKG", data=data,
-                                       file_name=f"parcely_{reg}_{resolved_ku or 'filter'}.gpkg", mime=mime)
-                    st.caption(f"Konverzia: {conv_src}")
-            except Exception as e:
+                ensure_gdal()
+            except RuntimeError as e:
                 st.error(f"Konverzia zlyhala: {e}")
+                conv_fmts = [f for f in conv_fmts if f in done]; todo = []
+        if conv_fmts:
+            # why: vo workeroch beží len čistá GDAL konverzia (mimo GIL), Streamlit cache aj widgety ostávajú na vlákne
+            # skriptu; max. 2 naraz – každá konverzia zapisuje všetky stránky do vlastného temp adresára
+            with ThreadPoolExecutor(max_workers=min(2, len(todo) or 1)) as ex:
+                jobs = {f: ex.submit(convert_pages_with_gdal, result.pages, *EXPORT_FORMATS[f][:2]) for f in todo}
+                # tlačidlá v poradí multiselectu, nie podľa toho, čo dobehne skôr
+                for f in conv_fmts:
+                    _, _, label, file_ext = EXPORT_FORMATS[f]
+                    try:
+                        data, mime, conv_src = done[f] if f in done else _convert(reg, ku_key, parcels, wfs_srs, f, _job=jobs[f])
+                    except Exception as e:
+                        st.error(f"Konverzia ({f}) zlyhala: {e}")
+                        continue
+                    st.download_button(label, data=data, file_name=f"{base_name}{file_ext}", mime=mime, key=f"dl_{f}")
+                    st.caption(f"Konverzia: {conv_src}")
@@ -1,11 +1,19 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import List, Optional, Tuple
-import json, re, time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlencode
+import json, random, re, time
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+try:
+    import orjson  # type: ignore
+except ImportError:  # why: orjson je len zrýchlenie, stdlib json stačí
+    orjson = None
+
 # --- Endpoints & constants ---
 CP_WFS_BASE    = "https://inspirews.skgeodesy.sk/geoserver/cp/ows"        # C register
 CP_UO_WFS_BASE = "https://inspirews.skgeodesy.sk/geoserver/cp_uo/ows"     # E register
@@ -20,6 +28,7 @@ HEADERS_XML = {
 # Cloud ↔ GKÚ potrebuje dlhší connect timeout
 TIMEOUT: tuple[int, int] = (25, 120)  # (connect, read)
 PAGE_SIZE = 1000
+PARALLEL_PAGES = 4  # súbežné GetFeature pri známom numberMatched (šetrne voči GKÚ)
 
 WMS_URL_C = "https://inspirews.skgeodesy.sk/geoserver/cp/ows"
 WMS_URL_E = "https://inspirews.skgeodesy.sk/geoserver/cp_uo/ows"
@@ -33,7 +42,7 @@ _retry = Retry(
     total=6, connect=6, read=6, status=6,
     backoff_factor=0.8,
     status_forcelist=(429, 500, 502, 503, 504),
-    allowed_methods=("GET",),
+    allowed_methods=("GET", "POST"),  # POST = len GetFeature s dlhým filtrom (čítanie, bezpečné opakovať)
     raise_on_status=False,
 )
 _adapter = HTTPAdapter(pool_connections=20, pool_maxsize=20, max_retries=_retry)
@@ -43,44 +52,64 @@ SESSION.mount("https://", _adapter)
 SESSION.mount("http://",  _adapter)
 
 # --- HTTP helper ---
+# why: FES filter pre stovky parciel je po URL-enkódovaní desiatky kB – za touto hranicou proxy/servery vracajú
+# 414/400, preto ten istý KVP dopyt pošleme ako form POST (GeoServer ho berie rovnako ako GET)
+MAX_GET_URL = 6000
+_FORM_HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
+
 def http_get_bytes(url: str, tries: int = 2) -> bytes:
-    last: Exception | None = None
-    for i in range(tries):
+    """GET na URL; príliš dlhé KVP dopyty idú ako form POST na základnú URL."""
+    base, _, query = url.partition("?")
+    post = len(url) > MAX_GET_URL and bool(query)
+    def send() -> bytes:
+        if post: r = SESSION.post(base, data=query, headers=_FORM_HEADERS, timeout=TIMEOUT)
+        else: r = SESSION.get(url, timeout=TIMEOUT)
+        r.raise_for_status()
+        return r.content
+    for i in range(max(1, tries) - 1):
         try:
-            r = SESSION.get(url, timeout=TIMEOUT)
-            r.raise_for_status()
-            return r.content
-        except Exception as e:
-            last = e
-            time.sleep(0.8 * (i + 1))  # exponenciálny backoff
-    assert last is not None
-    raise last
+            return send()
+        except requests.RequestException as e:
+            sc = getattr(getattr(e, "response", None), "status_code", None)
+            # why: 4xx (napr. 400 pri dlhom filtri) sa opakovaním nezmení – volajúci má vlastné fallbacky
+            if isinstance(e, requests.HTTPError) and sc is not None and 400 <= sc < 500 and sc != 429:
+                raise
+        # why: full jitter – súbežné stránky/klienti po výpadku neudrú na GeoServer naraz; po poslednom pokuse nespíme
+        time.sleep(random.uniform(0, min(8.0, 0.8 * 2 ** i)))
+    return send()  # posledný pokus – chyba ide priamo volajúcemu
 
 # --- FES/CQL builders ---
+_XML_ESCAPE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&apos;"})
+
 def xml_escape(text: str) -> str:
-    return (text.replace("&", "&amp;")
-                .replace("<", "&lt;")
-                .replace(">", "&gt;")
-                .replace('"', "&quot;")
-                .replace("'", "&apos;"))
+    return text.translate(_XML_ESCAPE)  # jeden prechod namiesto 5× replace
 
 def build_fes_filter(ku: str, parcels: List[str]) -> str:
+    # why: ten istý filter sa skladá pri prvom pokuse, CQL/FES fallbackoch aj v GeoJSON fetchi – stavba raz na (ku, parcely)
+    return _fes_filter(ku, tuple(parcels or ()))
+
+@lru_cache(maxsize=128)
+def _fes_filter(ku: str, parcels: Tuple[str, ...]) -> str:
     ku_part = (
         f'<PropertyIsLike wildCard="*" singleChar="." escape="!" matchCase="false">'
         f"<ValueReference>nationalCadastralReference</ValueReference><Literal>{xml_escape(ku)}*</Literal>"
         f"</PropertyIsLike>" if ku else ""
     )
     if parcels:
-        inner = []
-        for p in parcels:
-            p_xml = xml_escape(p)
-            ands = [f"<PropertyIsEqualTo><ValueReference>label</ValueReference><Literal>{p_xml}</Literal></PropertyIsEqualTo>"]
-            if ku_part: ands.append(ku_part)
-            inner.append("<And>" + "".join(ands) + "</And>")
-        return f'<Filter xmlns="http://www.opengis.net/fes/2.0"><Or>{"".join(inner)}</Or></Filter>'
+        # why: KU podmienka raz pre všetky parcely (ku AND (p1 OR p2 …)), nie kópia v každom <And> – filter
+        # (a URL) rastie O(N + K), nie O(N·K)
+        labels = "".join(f"<PropertyIsEqualTo><ValueReference>label</ValueReference><Literal>{xml_escape(p)}</Literal></PropertyIsEqualTo>"
+                         for p in parcels)
+        if len(parcels) > 1: labels = f"<Or>{labels}</Or>"
+        body = f"<And>{labels}{ku_part}</And>" if ku_part else labels
+        return f'<Filter xmlns="http://www.opengis.net/fes/2.0">{body}</Filter>'
     return f'<Filter xmlns="http://www.opengis.net/fes/2.0">{ku_part}</Filter>' if ku_part else ""
 
 def build_cql_filter(ku: str, parcels: List[str]) -> str:
+    return _cql_filter(ku, tuple(parcels or ()))
+
+@lru_cache(maxsize=128)
+def _cql_filter(ku: str, parcels: Tuple[str, ...]) -> str:
     parts: List[str] = []
     if parcels:
         q = ",".join(["'" + p.replace("'", "''") + "'" for p in parcels if p])
@@ -97,24 +126,83 @@ class FetchResult:
     pages: List[bytes]
     first_url: str
     detected_epsg: Optional[str] = None
+    matched: Optional[int] = None  # numberMatched, ak ho server poslal (pri max_features môže byť > stiahnuté)
 
 # --- Helpers ---
-_gml_has_features = lambda b: (b.find(b"featureMember")!=-1) or (b.find(b":member")!=-1) or (b.find(b"<wfs:member")!=-1)
+_PARCEL_SEP_RE = re.compile(r"[,;\s]+")
+
+@lru_cache(maxsize=64)
+def parse_parcels(parcels_csv: str) -> Tuple[str, ...]:
+    """'1/2, 3;4 5' → ('1/2', '3', '4', '5'). Spoločný rozklad pre WFS filtre aj WMS náhľad."""
+    # why: pri kopírovaní z tabuľky sa čísla opakujú – duplicity by len nafúkli filter; poradie ostáva
+    return tuple(dict.fromkeys(p for p in _PARCEL_SEP_RE.split(parcels_csv or "") if p))
+
+# why: počty sú atribúty koreňového <wfs:FeatureCollection> (aj s xmlns/schemaLocation pár kB) – bez nich
+# (napr. ExceptionReport, WFS 1.x) by regex zbytočne prešiel celú stránku; pos/endpos nerobí kópiu
+_GML_HEAD = 16384
+
+def _gml_has_features(b: bytes) -> bool:
+    # why: prvý <wfs:member> (WFS 2.0) / featureMember (WFS 1.x) nasleduje hneď za koreňom – obe hľadáme najprv
+    # v hlavičke (WFS 1.x tak neprejde celú stránku naprázdno kvôli `:member`), celú stránku len ako poistku
+    if b.find(b":member", 0, _GML_HEAD) != -1 or b.find(b"featureMember", 0, _GML_HEAD) != -1: return True
+    return len(b) > _GML_HEAD and (b.find(b":member") != -1 or b.find(b"featureMember") != -1)
+
+_GML_RETURNED_RE = re.compile(rb'numberReturned="(\d+)"')
+_GML_MATCHED_RE = re.compile(rb'numberMatched="(\d+)"')
 
 def _gml_number_returned(xmlb: bytes) -> Optional[int]:
-    m = re.search(rb'numberReturned="(\d+)"', xmlb)
+    m = _GML_RETURNED_RE.search(xmlb, 0, _GML_HEAD)
+    return int(m.group(1)) if m else None
+
+def _gml_number_matched(xmlb: bytes) -> Optional[int]:
+    m = _GML_MATCHED_RE.search(xmlb, 0, _GML_HEAD)
     return int(m.group(1)) if m else None
 
+# srsName v tvare 'EPSG:5514', 'urn:ogc:def:crs:EPSG::5514' aj 'http://www.opengis.net/def/crs/EPSG/0/5514'
+_GML_SRS_RE = re.compile(rb'srsName="[^"]*?EPSG[:/][^"]*?(\d+)"')
+
+def _gml_detect_epsg(xmlb: bytes) -> Optional[str]:
+    """'EPSG:<kód>' z prvého srsName na stránke (boundedBy/prvá geometria) – len prvá stránka, jeden prechod."""
+    m = _GML_SRS_RE.search(xmlb)
+    return f"EPSG:{int(m.group(1))}" if m else None
+
+_JSON_RETURNED_RE = re.compile(rb'"numberReturned"\s*:\s*(\d+)')
+_JSON_MATCHED_RE = re.compile(rb'"numberMatched"\s*:\s*(\d+)')
+
+def _geojson_counts(jb: bytes) -> Tuple[int, Optional[int]]:
+    """(numberReturned, numberMatched) GeoJSON stránky bez parsovania celého dokumentu."""
+    # why: GeoServer dáva počty na koniec za features – stačí pozrieť chvost; bez nich parsujeme
+    tail = jb[-4096:]
+    m = _JSON_RETURNED_RE.search(tail)
+    if m:
+        mm = _JSON_MATCHED_RE.search(tail)
+        return int(m.group(1)), (int(mm.group(1)) if mm else None)
+    # why: JSONDecodeError (stdlib aj orjson) aj UnicodeDecodeError sú ValueError; AttributeError = JSON nie je objekt
+    try: obj = _json_loads(jb); nm = obj.get("numberMatched"); n = len(obj.get("features") or [])
+    except (ValueError, AttributeError, TypeError): return 0, None
+    return n, (nm if isinstance(nm, int) else None)
+
+def _paged_url(base: str, params: dict) -> Callable[[int], str]:
+    """URL pre daný startIndex; parametre (vrátane kilobajtového filtra) sa URL-enkódujú raz, nie pre každú stránku."""
+    prefix = f"{base}?{urlencode(params)}&startIndex="
+    return lambda start_i: f"{prefix}{start_i}"
+
+def _fetch_pages_parallel(url_at: Callable[[int], str], starts: Iterable[int]) -> List[bytes]:
+    """Stiahne stránky pre dané startIndex súbežne; poradie zachová, prvá chyba sa vyhodí."""
+    starts = list(starts)
+    if not starts: return []
+    with ThreadPoolExecutor(max_workers=min(PARALLEL_PAGES, len(starts))) as ex:
+        return list(ex.map(lambda s: http_get_bytes(url_at(s), tries=2), starts))
+
 # --- WFS: GML paging (prefer CQL pri parcelách; lepšie retry) ---
 def fetch_gml_pages(register: str, ku: str, parcels_csv: str, wfs_srs: Optional[str] = None) -> FetchResult:
     reg = (register or "").upper().strip()
     ku = (ku or "").strip()
     if not ku and not (parcels_csv or "").strip():
         return FetchResult(False, "Zadaj aspoň KU alebo parcelné čísla.", [], "")
-    parcels = [p.strip() for p in re.split(r"[,;\s]+", parcels_csv or "") if p.strip()]
+    parcels = parse_parcels(parcels_csv or "")
     base = CP_UO_WFS_BASE if reg == "E" else CP_WFS_BASE
     typename = TYPE_E if reg == "E" else TYPE_C
-    from urllib.parse import urlencode
 
     # 1) Prefer CQL keď sú parcely (GeoServer to spraví rýchlejšie)
     if parcels:
@@ -123,24 +211,31 @@ def fetch_gml_pages(register: str, ku: str, parcels_csv: str, wfs_srs: Optional[
                   "typeNames":typename,"count":str(PAGE_SIZE),"startIndex":"0","CQL_FILTER": cql}
         if wfs_srs: params["srsName"] = wfs_srs
         url = f"{base}?{urlencode(params)}"
+        # why: do FES padáme len pri 400 (server CQL nepodporuje); prázdny výsledok či výpadok by FES len zopakoval
         try:
             b = http_get_bytes(url, tries=2)
             if _gml_has_features(b):
-                return FetchResult(True, "CQL (parcely)", [b], url)
+                return FetchResult(True, "CQL (parcely)", [b], url, detected_epsg=_gml_detect_epsg(b))
+            return FetchResult(False, "Server vrátil 0 prvkov pre daný filter.", [], url)
         except requests.exceptions.ConnectTimeout:
             # skús bez srsName
-            if wfs_srs:
-                params.pop("srsName", None)
-                url = f"{base}?{urlencode(params)}"
-                try:
-                    b = http_get_bytes(url, tries=2)
-                    if _gml_has_features(b):
-                        return FetchResult(True, "CQL bez srsName (parcely)", [b], url)
-                except Exception as e:
-                    return FetchResult(False, f"Connect timeout: {e}", [], url)
+            if not wfs_srs:
+                return FetchResult(False, f"Connect timeout na {url}", [], url)
+            params.pop("srsName", None)
+            url = f"{base}?{urlencode(params)}"
+            try:
+                b = http_get_bytes(url, tries=2)
+            except Exception as e:
+                return FetchResult(False, f"Connect timeout: {e}", [], url)
+            if _gml_has_features(b):
+                return FetchResult(True, "CQL bez srsName (parcely)", [b], url, detected_epsg=_gml_detect_epsg(b))
+            return FetchResult(False, "Server vrátil 0 prvkov pre daný filter.", [], url)
+        except requests.HTTPError as e:
+            if getattr(e.response, "status_code", None) != 400:
+                return FetchResult(False, f"HTTP chyba: {e}", [], url)
+            # 400 → FES fallback nižšie
         except Exception as e:
-            # padáme do FES fallbacku nižšie
-            pass
+            return FetchResult(False, f"Chyba: {e}", [], url)
 
     # 2) FES stránkovanie (pre KU-only alebo fallback)
     fes = build_fes_filter(ku, parcels)
@@ -151,13 +246,19 @@ def fetch_gml_pages(register: str, ku: str, parcels_csv: str, wfs_srs: Optional[
     start = 0
     first_url = ""
     dropped_srs = False
+    via_cql = False
+    matched: Optional[int] = None  # numberMatched z prvej stránky
+
+    fes_params = {"service":"WFS","version":"2.0.0","request":"GetFeature","typeNames":typename,
+                  "count":str(PAGE_SIZE),"filter":fes}
+    url_plain = _paged_url(base, fes_params)
+    url_srs = _paged_url(base, {**fes_params, "srsName": wfs_srs}) if wfs_srs else url_plain
+
+    def fes_url(start_i: int) -> str:
+        return (url_plain if dropped_srs else url_srs)(start_i)
 
     while True:
-        params = {"service":"WFS","version":"2.0.0","request":"GetFeature","typeNames":typename,
-                  "count":str(PAGE_SIZE),"startIndex":str(start),"filter":fes}
-        if wfs_srs and not dropped_srs:
-            params["srsName"] = wfs_srs
-        url = f"{base}?{urlencode(params)}"
+        url = fes_url(start)
         first_url = first_url or url
 
         try:
@@ -171,20 +272,21 @@ def fetch_gml_pages(register: str, ku: str, parcels_csv: str, wfs_srs: Optional[
                 continue
             # split-by-one fallback (bezpečný pri malom počte parciel)
             if sc == 400 and parcels:
-                singles: List[bytes] = []
-                for pval in parcels:
+                def _single(pval: str) -> Optional[bytes]:
                     sp = {"service":"WFS","version":"2.0.0","request":"GetFeature","typeNames":typename,
                           "count":"1000","startIndex":"0","filter": build_fes_filter(ku,[pval])}
                     if not dropped_srs and wfs_srs: sp["srsName"] = wfs_srs
-                    surl = f"{base}?{urlencode(sp)}"
                     try:
-                        sb = http_get_bytes(surl, tries=2)
-                        if _gml_has_features(sb):
-                            singles.append(sb)
+                        sb = http_get_bytes(f"{base}?{urlencode(sp)}", tries=2)
                     except Exception:
-                        pass
+                        return None
+                    return sb if _gml_has_features(sb) else None
+                # why: dopyty na jednotlivé parcely sú nezávislé – súbežne (v poradí parciel), nie N sekvenčných RTT
+                with ThreadPoolExecutor(max_workers=min(PARALLEL_PAGES, len(parcels))) as ex:
+                    singles = [sb for sb in ex.map(_single, parcels) if sb]
                 if singles:
-                    return FetchResult(True, f"Počet stránok: {len(singles)} (split-by-one)", singles, first_url)
+                    return FetchResult(True, f"Počet stránok: {len(singles)} (split-by-one)", singles, first_url,
+                                       detected_epsg=_gml_detect_epsg(singles[0]))
             # CQL fallback aj pri KU-only (ak FES padá)
             cql = build_cql_filter(ku, parcels)
             if cql:
@@ -193,7 +295,7 @@ def fetch_gml_pages(register: str, ku: str, parcels_csv: str, wfs_srs: Optional[
                 if not dropped_srs and wfs_srs: cql_params["srsName"] = wfs_srs
                 cql_url = f"{base}?{urlencode(cql_params)}"; first_url = first_url or cql_url
                 try:
-                    xmlb = http_get_bytes(cql_url, tries=2)
+                    xmlb = http_get_bytes(cql_url, tries=2); via_cql = True
                 except Exception as ee:
                     return FetchResult(False, f"HTTP chyba: {e}\nCQL fallback zlyhal: {ee}", [], first_url or url)
             else:
@@ -217,81 +319,169 @@ def fetch_gml_pages(register: str, ku: str, parcels_csv: str, wfs_srs: Optional[
             if len(xmlb) < 10000: break
             start += PAGE_SIZE
         if start > 500_000: break
+        if len(pages) == 1 and not via_cql: matched = _gml_number_matched(xmlb)
+        if matched is not None and start >= matched: break  # why: všetko je stiahnuté – bez prázdnej "koncovej" stránky
+        if len(pages) == 1 and matched is not None:
+            # why: celkový počet je známy – zvyšné stránky ťaháme súbežne namiesto N sekvenčných RTT;
+            # pri chybe dobehne pôvodná sekvenčná slučka so svojimi fallbackmi
+            try:
+                rest = _fetch_pages_parallel(fes_url, range(start, min(matched, 500_000), PAGE_SIZE))
+            except Exception:
+                continue
+            pages.extend(b for b in rest if _gml_has_features(b))
+            break
 
     if not pages:
         return FetchResult(False, "Server vrátil 0 prvkov pre daný filter.", [], first_url)
-    return FetchResult(True, f"Počet stránok: {len(pages)}", pages, first_url)
+    return FetchResult(True, f"Počet stránok: {len(pages)}", pages, first_url, detected_epsg=_gml_detect_epsg(pages[0]))
 
 # --- WFS: GeoJSON paging (pre preview/DXF) ---
-def fetch_geojson_pages(register: str, ku: str, parcels_csv: str, wfs_srs: Optional[str] = None) -> FetchResult:
-    reg = (register or "").upper().strip()
-    ku = (ku or "").strip()
-    parcels = [p.strip() for p in re.split(r"[,\s]+", parcels_csv or "") if p.strip()]
-    base = CP_UO_WFS_BASE if reg == "E" else CP_WFS_BASE
-    typename = TYPE_E if reg == "E" else TYPE_C
-    from urllib.parse import urlencode
-    filt_xml = build_fes_filter(ku, parcels)
-    if not filt_xml: return FetchResult(False, "Neplatný filter (chýba KU aj parcely)", [], "")
-
+def _page_geojson(json_url: Callable[[int], str], max_features: Optional[int]
+                  ) -> Tuple[List[bytes], Optional[int], str, Optional[int]]:
+    """Stránkuje jeden GeoJSON dopyt. Vráti (stránky, numberMatched, chyba, HTTP status chyby)."""
     pages: List[bytes] = []
     start = 0
-    first_url = ""
+    matched: Optional[int] = None
     while True:
-        params = {"service":"WFS","version":"2.0.0","request":"GetFeature","typeNames":typename,
-                  "count":str(PAGE_SIZE),"startIndex":str(start),"filter":filt_xml,"outputFormat":"application/json"}
-        if wfs_srs: params["srsName"] = wfs_srs
-        url = f"{base}?{urlencode(params)}"; first_url = first_url or url
         try:
-            jb = http_get_bytes(url)
+            jb = http_get_bytes(json_url(start))
         except requests.HTTPError as e:
-            if pages and getattr(e.response, "status_code", None) == 400: break
-            return FetchResult(False, f"HTTP chyba: {e}", [], first_url or url)
+            status = getattr(e.response, "status_code", None)
+            if pages and status == 400: break
+            return pages, matched, f"HTTP chyba: {e}", status
         except Exception as e:
-            return FetchResult(False, f"Chyba: {e}", [], first_url or url)
-        try:
-            obj = json.loads(jb.decode("utf-8", "ignore")); feats = obj.get("features", [])
-        except Exception:
-            feats = []
-        if not feats: break
+            return pages, matched, f"Chyba: {e}", None
+        # why: stránky sa parsujú až v merge/iter – tu stačí počet prvkov, nie celý strom
+        n_ret, nm = _geojson_counts(jb)
+        if not n_ret: break
         pages.append(jb)
-        if len(feats) < PAGE_SIZE: break
+        if n_ret < PAGE_SIZE: break
         start += PAGE_SIZE
-        if start > 500_000: break
-    if not pages: return FetchResult(False, "Server vrátil 0 prvkov pre daný filter.", [], first_url)
-    return FetchResult(True, f"Počet stránok: {len(pages)}", pages, first_url)
+        if start > 500_000 or (max_features is not None and start >= max_features): break
+        if len(pages) == 1: matched = nm
+        if matched is not None and start >= matched: break  # ako pri GML – bez prázdnej koncovej stránky
+        if len(pages) == 1 and matched is not None:
+            # why: ako pri GML – zvyšok stránok súbežne, pri chybe sekvenčne
+            try:
+                stop = min(matched, 500_000 if max_features is None else max_features)
+                rest = _fetch_pages_parallel(json_url, range(start, stop, PAGE_SIZE))
+            except Exception:
+                continue
+            pages.extend(rest)
+            break
+    return pages, matched, "", None
+
+def fetch_geojson_pages(register: str, ku: str, parcels_csv: str, wfs_srs: Optional[str] = None,
+                        max_features: Optional[int] = None, properties: Optional[Tuple[str, ...]] = None) -> FetchResult:
+    """GeoJSON stránky; s max_features sa stránky za limitom (napr. pre náhľad) vôbec nesťahujú,
+    s properties server pošle len tieto vlastnosti (propertyName)."""
+    reg = (register or "").upper().strip()
+    ku = (ku or "").strip()
+    parcels = parse_parcels(parcels_csv or "")
+    base = CP_UO_WFS_BASE if reg == "E" else CP_WFS_BASE
+    typename = TYPE_E if reg == "E" else TYPE_C
+    filt_xml = build_fes_filter(ku, parcels)
+    if not filt_xml: return FetchResult(False, "Neplatný filter (chýba KU aj parcely)", [], "")
+
+    common = {"service":"WFS","version":"2.0.0","request":"GetFeature","typeNames":typename,
+              "count":str(PAGE_SIZE),"outputFormat":"application/json"}
+    if wfs_srs: common["srsName"] = wfs_srs
+    # why: ako pri GML – pri parcelách najprv CQL (kratšia URL, server ho parsuje rýchlejšie), FES ostáva ako fallback
+    filters = [{"CQL_FILTER": build_cql_filter(ku, parcels)}] if parcels else []
+    filters.append({"filter": filt_xml})
+    # why: 400 s propertyName = server nepozná názvy vlastností – len vtedy celé znova bez neho
+    props = [{"propertyName": ",".join(properties)}, {}] if properties else [{}]
+    result = FetchResult(False, "Server vrátil 0 prvkov pre daný filter.", [], "")
+    for prop, filt in [(p, f) for p in props for f in filters]:
+        json_url = _paged_url(base, {**common, **prop, **filt})
+        pages, matched, err, status = _page_geojson(json_url, max_features)
+        if pages: return FetchResult(True, f"Počet stránok: {len(pages)}", pages, json_url(0), matched=matched)
+        result = FetchResult(False, err or "Server vrátil 0 prvkov pre daný filter.", [], json_url(0))
+        # ďalší pokus (CQL → FES, bez propertyName) len pri 400; prázdny výsledok či výpadok vraciame hneď
+        if status != 400: break
+    return result
 
 # --- GeoJSON helpers ---
-def merge_geojson_pages(pages: List[bytes], max_features: int = 8000):
-    feats, total = [], 0
+def _json_loads(b: bytes):
+    """JSON z bytes – cez orjson (bez medzikópie do str), ak je dostupný."""
+    if orjson is not None:
+        try: return orjson.loads(b)
+        except orjson.JSONDecodeError: pass  # why: napr. neplatné UTF-8 – stdlib s 'ignore' to prežije
+    return json.loads(b.decode("utf-8", "ignore"))
+
+def iter_geojson_page_features(pages: List[bytes]) -> Iterator[List[dict]]:
+    """Po stránkach vracia zoznam features; dict stránky sa hneď zahodí."""
     for jb in pages:
-        try: obj = json.loads(jb.decode("utf-8", "ignore")); f = obj.get("features", [])
-        except Exception: f = []
+        try: obj = _json_loads(jb); f = obj.get("features", [])
+        except (ValueError, AttributeError): f = []  # ako v _geojson_counts – len chybné JSON, nie iné chyby
+        yield f
+
+def iter_geojson_features(pages: List[bytes]) -> Iterator[dict]:
+    """Features zo všetkých stránok po jednom (bez zlúčeného FeatureCollection)."""
+    for f in iter_geojson_page_features(pages):
+        yield from f
+
+def merge_geojson_pages(pages: List[bytes], max_features: int = 8000):
+    feats, total, i = [], 0, 0
+    for i, f in enumerate(iter_geojson_page_features(pages), 1):
         total += len(f)
         if len(feats) < max_features:
             room = max_features - len(feats)
             feats.extend(f[:room])
         if len(feats) >= max_features: break
+    # why: stránky za limitom sa neparsujú – do celkového počtu stačí numberReturned z ich chvosta
+    total += sum(_geojson_counts(jb)[0] for jb in pages[i:])
     return {"type": "FeatureCollection", "features": feats}, total, len(feats)
 
 def _walk_coords(geom: dict, agg: List[float]):
     if not geom: return
-    coords = geom.get("coordinates")
-    def _rec(c):
-        if isinstance(c, (list, tuple)):
-            if c and isinstance(c[0], (int, float)) and isinstance(c[1], (int, float)):
-                x, y = float(c[0]), float(c[1])
-                agg[0] = min(agg[0], x); agg[1] = min(agg[1], y)
-                agg[2] = max(agg[2], x); agg[3] = max(agg[3], y)
-            else:
-                for cc in c: _rec(cc)
-    _rec(coords)
+    lx, ly, hx, hy = agg
+    # why: iteratívne (bez rekurzie) a celý kruh naraz cez min/max v C – nie 4 volania na každý vrchol
+    stack = [geom.get("coordinates")]
+    while stack:
+        c = stack.pop()
+        if not isinstance(c, (list, tuple)) or not c: continue
+        c0 = c[0]
+        if isinstance(c0, (int, float)):
+            if len(c) > 1 and isinstance(c[1], (int, float)):
+                x, y = float(c0), float(c[1])
+                if x < lx: lx = x
+                if x > hx: hx = x
+                if y < ly: ly = y
+                if y > hy: hy = y
+        elif isinstance(c0, (list, tuple)) and c0 and isinstance(c0[0], (int, float)):
+            try:
+                xs = [float(p[0]) for p in c]; ys = [float(p[1]) for p in c]
+                lx = min(lx, min(xs)); hx = max(hx, max(xs))
+                ly = min(ly, min(ys)); hy = max(hy, max(ys))
+            except (TypeError, ValueError, IndexError, KeyError):
+                stack.extend(c)  # chybný kruh – po vrcholoch s kontrolou typov
+        else:
+            stack.extend(c)
+    agg[0], agg[1], agg[2], agg[3] = lx, ly, hx, hy
+
+def bbox_from_features(features: List[dict]) -> Optional[Tuple[float, float, float, float]]:
+    """Bbox priamo zo zoznamu features (bez obaľovania do FeatureCollection)."""
+    agg = [float("inf"), float("inf"), float("-inf"), float("-inf")]
+    for f in features:
+        f = f or {}
+        fb = f.get("bbox")
+        # why: ak server dá bbox prvku (2D: [minx,miny,maxx,maxy]), súradnice netreba prechádzať
+        if isinstance(fb, (list, tuple)) and len(fb) == 4 and all(isinstance(v, (int, float)) for v in fb):
+            if fb[0] < agg[0]: agg[0] = float(fb[0])
+            if fb[1] < agg[1]: agg[1] = float(fb[1])
+            if fb[2] > agg[2]: agg[2] = float(fb[2])
+            if fb[3] > agg[3]: agg[3] = float(fb[3])
+        else:
+            _walk_coords(f.get("geometry") or {}, agg)
+    return None if agg[0] == float("inf") else tuple(agg)  # type: ignore[return-value]
 
 def bbox_from_geojson(obj: dict) -> Optional[Tuple[float, float, float, float]]:
     if not obj: return None
-    agg = [float("inf"), float("inf"), float("-inf"), float("-inf")]
     if obj.get("type") == "FeatureCollection":
-        for f in obj.get("features", []): _walk_coords((f or {}).get("geometry") or {}, agg)
-    elif obj.get("type") == "Feature":
+        return bbox_from_features(obj.get("features", []))
+    agg = [float("inf"), float("inf"), float("-inf"), float("-inf")]
+    if obj.get("type") == "Feature":
         _walk_coords((obj or {}).get("geometry") or {}, agg)
     else:
         _walk_coords(obj, agg)
@@ -318,21 +508,22 @@ def fetch_zone_bbox(register: str, ku_code: str) -> Optional[Tuple[float,float,f
         ("cp:CP.CadastralZoning", CP_WFS_BASE),
         ("cp_uo:CP.CadastralZoningUO", CP_UO_WFS_BASE),
     ]
-    from urllib.parse import urlencode
     for type_name, base in candidates:
+        params = {
+            "service": "WFS", "version": "2.0.0", "request": "GetFeature",
+            "typeNames": type_name, "outputFormat": "application/json",
+            "srsName": "EPSG:4326", "CQL_FILTER": f"nationalCadastralReference='{ku}'",
+        }
+        url = f"{base}?{urlencode(params)}"
         try:
-            params = {
-                "service": "WFS", "version": "2.0.0", "request": "GetFeature",
-                "typeNames": type_name, "outputFormat": "application/json",
-                "srsName": "EPSG:4326", "CQL_FILTER": f"nationalCadastralReference='{ku}'",
-            }
-            url = f"{base}?{urlencode(params)}"
             jb = http_get_bytes(url)
-            obj = json.loads(jb.decode("utf-8", "ignore"))
-            fc = {"type":"FeatureCollection","features": obj.get("features", [])}
-            bb = bbox_from_geojson(fc)
-            if bb:
-                return bb # minx,miny,maxx,maxy in EPSG:4326
-        except Exception:
+        except requests.RequestException:
+            continue
+        try:
+            obj = _json_loads(jb)
+            bb = bbox_from_features(obj.get("features", []))
+        except (ValueError, AttributeError, TypeError):
             continue
+        if bb:
+            return bb # minx,miny,maxx,maxy in EPSG:4326
     return None